@@ -1,15 +1,56 @@
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Query
+from typing import List, Optional, Union
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
+import orjson
+from cachetools import TTLCache
+import google_auth_httplib2
+import httplib2
+from google.auth.transport.requests import Request as AuthRequest
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
 import os
 import json
+import hashlib
 from datetime import datetime, timedelta
 import aiohttp
 import asyncio
+import bisect
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-app = FastAPI()
+# Optional accelerator: vectorizes report aggregation when available
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+@app.on_event("startup")
+async def configure_executor():
+    # The Drive client blocks on httplib2 sockets; give the loop a pool large
+    # enough that concurrent requests don't queue behind the small default.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=64, thread_name_prefix="drive")
+    )
+
+@app.on_event("startup")
+async def open_http_session():
+    # One shared session for all outbound HTTP (e.g. the processor service);
+    # creating a session per request would throw away the connection pool
+    # and DNS cache on every call.
+    app.state.http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100, ttl_dns_cache=300, keepalive_timeout=60
+        )
+    )
+
+@app.on_event("shutdown")
+async def close_http_session():
+    await app.state.http.close()
 
 # Models
 class DocumentList(BaseModel):
@@ -24,10 +65,16 @@ class StatusResponse(BaseModel):
     last_update: str
 
 class ReportResponse(BaseModel):
-    report_content: str
+    # Markdown reports are a string; json reports embed the file list
+    # directly so it is only JSON-encoded once, by the response
+    report_content: Union[str, List[dict]]
     generated_at: str
     format: str
 
+# Static Drive query fragments
+CLASSIFIED_QUERY = "properties has { key='classified' and value='true' }"
+UNCLASSIFIED_QUERY = "not properties has { key='classified' and value='true' }"
+
 # Configuration
 class Config:
     def __init__(self):
@@ -35,87 +82,258 @@ class Config:
         self.max_results_per_page = int(os.getenv('MAX_RESULTS_PER_PAGE', '100'))
         self.supported_mime_types = os.getenv('SUPPORTED_MIME_TYPES', '').split(',')
         self.processor_url = os.getenv('PROCESSOR_URL')
+        self.drive_concurrency = int(os.getenv('DRIVE_CONCURRENCY', '20'))
+        # Precompute the mime-type filter so endpoints don't rebuild the
+        # same query fragment on every request
+        mime_filters = [
+            f"mimeType = '{mime}'" for mime in self.supported_mime_types if mime
+        ]
+        self.mime_query = f"({' or '.join(mime_filters)})" if mime_filters else None
 
 config = Config()
 
+def escape_query_value(value: str) -> str:
+    """Escape a user-supplied value for embedding in a Drive query string."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+@lru_cache(maxsize=256)
+def build_documents_query(folder_id: Optional[str], include_processed: bool) -> Optional[str]:
+    """Build the /documents Drive query, memoized per query shape."""
+    query_parts = []
+
+    # Filter by folder
+    if folder_id:
+        query_parts.append(f"'{escape_query_value(folder_id)}' in parents")
+
+    # Filter by mime types
+    if config.mime_query:
+        query_parts.append(config.mime_query)
+
+    # Filter out processed documents unless included
+    if not include_processed:
+        query_parts.append(UNCLASSIFIED_QUERY)
+
+    return " and ".join(query_parts) if query_parts else None
+
+@lru_cache(maxsize=256)
+def build_report_query(start_date: Optional[str], end_date: Optional[str]) -> str:
+    """Build the classified-documents query for a report date range."""
+    query_parts = [CLASSIFIED_QUERY]
+
+    if start_date:
+        query_parts.append(f"modifiedTime >= '{escape_query_value(start_date)}'")
+    if end_date:
+        query_parts.append(f"modifiedTime <= '{escape_query_value(end_date)}'")
+
+    return " and ".join(query_parts)
+
+# In-process response caches; repeat calls within the configured window skip
+# the Drive round trips entirely
+status_cache = TTLCache(maxsize=4, ttl=config.cache_duration_days * 86400)
+report_cache = TTLCache(maxsize=32, ttl=config.cache_duration_days * 86400)
+
+def response_etag(model: BaseModel) -> str:
+    """Compute an ETag for a cached response model."""
+    digest = hashlib.blake2b(
+        model.model_dump_json().encode(), digest_size=16
+    ).hexdigest()
+    return f'"{digest}"'
+
 # Google Drive client setup
+_service_cache = {}
+
+def _drive_request_builder(credentials):
+    """Return a request builder giving each API call its own transport.
+
+    httplib2 keeps a single connection per Http object and is not
+    thread-safe, so concurrent calls through a shared transport would
+    serialize on one TLS socket (or corrupt it). A per-request
+    AuthorizedHttp sidesteps both; drive_semaphore bounds how many exist
+    at once.
+    """
+    def builder(http, *args, **kwargs):
+        authorized_http = google_auth_httplib2.AuthorizedHttp(
+            credentials, http=httplib2.Http()
+        )
+        return HttpRequest(authorized_http, *args, **kwargs)
+    return builder
+
 def get_drive_service():
+    """Return a cached Drive service, rebuilding only when token.json rotates."""
     token_path = os.getenv('GOOGLE_TOKEN_PATH', 'token.json')
     if not os.path.exists(token_path):
         raise HTTPException(status_code=500, detail="Google OAuth token not found")
-    
-    with open(token_path, 'r') as token:
-        token_data = json.load(token)
+
+    # Key the cache on the token file's mtime so a rotated token invalidates it
+    cache_key = (token_path, os.stat(token_path).st_mtime_ns)
+    cached = _service_cache.get(cache_key)
+    if cached is None:
+        with open(token_path, 'r') as token:
+            token_data = json.load(token)
         credentials = Credentials.from_authorized_user_info(token_data)
-        return build('drive', 'v3', credentials=credentials)
+        service = build(
+            'drive', 'v3', credentials=credentials,
+            requestBuilder=_drive_request_builder(credentials),
+            cache_discovery=False, static_discovery=True
+        )
+        _service_cache.clear()
+        _service_cache[cache_key] = (credentials, service)
+        return service
+    return cached[1]
+
+async def _refresh_credentials_loop():
+    """Refresh cached credentials shortly before they expire.
+
+    Refreshing in the background keeps the blocking token exchange out of
+    the request path; if a refresh fails here, the client library's lazy
+    refresh still covers the next request.
+    """
+    while True:
+        await asyncio.sleep(30)
+        for credentials, _ in list(_service_cache.values()):
+            expiry = credentials.expiry
+            if (credentials.refresh_token and expiry is not None
+                    and expiry - datetime.utcnow() < timedelta(seconds=60)):
+                try:
+                    await asyncio.to_thread(credentials.refresh, AuthRequest())
+                except Exception:
+                    pass
+
+@app.on_event("startup")
+async def start_credential_refresher():
+    app.state.credential_refresher = asyncio.create_task(
+        _refresh_credentials_loop()
+    )
+
+@app.on_event("shutdown")
+async def stop_credential_refresher():
+    app.state.credential_refresher.cancel()
+
+# Cap in-flight Drive operations so a burst of requests can't spawn an
+# unbounded number of executor jobs and thrash connections
+drive_semaphore = asyncio.Semaphore(config.drive_concurrency)
+
+async def execute_drive_request(request):
+    """Run a blocking googleapiclient request without stalling the event loop."""
+    async with drive_semaphore:
+        return await asyncio.to_thread(request.execute)
 
 # Routes
 @app.get("/documents", response_model=DocumentList)
 async def list_documents(
+    request: Request,
+    http_response: Response,
     folder_id: Optional[str] = None,
     page_token: Optional[str] = None,
     page_size: Optional[int] = Query(default=50, le=1000),
-    include_processed: bool = False
+    include_processed: bool = False,
+    max_pages: int = Query(default=1, ge=1, le=20)
 ):
-    """List documents in Google Drive that can be classified."""
+    """List documents in Google Drive that can be classified.
+
+    Bulk consumers can set max_pages > 1 to have the server walk several
+    pages per call instead of paying one HTTP round trip per page.
+    """
     service = get_drive_service()
-    
-    # Build query
-    query_parts = []
-    
-    # Filter by folder
-    if folder_id:
-        query_parts.append(f"'{folder_id}' in parents")
-    
-    # Filter by mime types
-    if config.supported_mime_types:
-        mime_types = [f"mimeType = '{mime}'" for mime in config.supported_mime_types]
-        query_parts.append(f"({' or '.join(mime_types)})")
-    
-    # Filter out processed documents unless included
-    if not include_processed:
-        query_parts.append("not properties has { key='classified' and value='true' }")
-    
-    query = " and ".join(query_parts) if query_parts else None
-    
+
+    query = build_documents_query(folder_id, include_processed)
+
     try:
-        response = service.files().list(
-            q=query,
-            spaces='drive',
-            fields='nextPageToken, files(id, name, mimeType, createdTime, modifiedTime, owners, size)',
-            pageToken=page_token,
-            pageSize=min(page_size, config.max_results_per_page)
-        ).execute()
-        
+        # Drive page tokens are opaque and only come back one page at a
+        # time, so pages are walked here rather than fetched concurrently
+        documents = []
+        next_token = page_token
+        for _ in range(max_pages):
+            response = await execute_drive_request(service.files().list(
+                q=query,
+                spaces='drive',
+                fields='nextPageToken, files(id, name, mimeType, createdTime, modifiedTime, owners, size)',
+                pageToken=next_token,
+                pageSize=min(page_size, config.max_results_per_page)
+            ))
+            documents.extend(response.get('files', []))
+            next_token = response.get('nextPageToken')
+            if not next_token:
+                break
+
+        # Pollers re-fetching an unchanged listing get a bodyless 304
+        # instead of re-downloading and re-parsing the same page
+        digest = hashlib.blake2b(
+            orjson.dumps(documents), digest_size=16
+        ).hexdigest()
+        etag = f'"{digest}"'
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304)
+        http_response.headers['ETag'] = etag
+
         return DocumentList(
-            documents=response.get('files', []),
-            next_page_token=response.get('nextPageToken'),
-            total_count=len(response.get('files', []))
+            documents=documents,
+            next_page_token=next_token,
+            total_count=len(documents)
         )
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/status", response_model=StatusResponse)
-async def get_status():
+async def get_status(request: Request, http_response: Response):
     """Get the current classification status."""
+    status = status_cache.get('status')
+    if status is None:
+        status = await _compute_status()
+        status_cache['status'] = status
+
+    etag = response_etag(status)
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304)
+    http_response.headers['ETag'] = etag
+    return status
+
+async def _compute_status() -> StatusResponse:
     service = get_drive_service()
-    
+
+    total_query = config.mime_query
+    classified_query = CLASSIFIED_QUERY
+
     try:
-        # Get total documents
-        total_response = service.files().list(
-            q=" or ".join(f"mimeType = '{mime}'" for mime in config.supported_mime_types),
-            fields="files(id)"
-        ).execute()
-        
-        # Get classified documents
-        classified_response = service.files().list(
-            q="properties has { key='classified' and value='true' }",
-            fields="files(id)"
-        ).execute()
-        
-        total_count = len(total_response.get('files', []))
-        classified_count = len(classified_response.get('files', []))
+        # Page through both queries keeping only running counts, so memory
+        # stays O(1) however large the corpus is. Each round batches the next
+        # page of whichever queries are still active into one round trip.
+        counts = {'total': 0, 'classified': 0}
+        page_tokens = {}
+        active = {'total': total_query, 'classified': classified_query}
+
+        while active:
+            pages = {}
+
+            def collect(request_id, response, exception):
+                if exception is not None:
+                    raise exception
+                pages[request_id] = response
+
+            batch = service.new_batch_http_request(callback=collect)
+            for request_id, query in active.items():
+                batch.add(
+                    service.files().list(
+                        q=query,
+                        fields='nextPageToken, files/id',
+                        pageSize=1000,
+                        pageToken=page_tokens.get(request_id)
+                    ),
+                    request_id=request_id
+                )
+            await execute_drive_request(batch)
+
+            for request_id, response in pages.items():
+                counts[request_id] += len(response.get('files', []))
+                next_token = response.get('nextPageToken')
+                if next_token:
+                    page_tokens[request_id] = next_token
+                else:
+                    del active[request_id]
+
+        total_count = counts['total']
+        classified_count = counts['classified']
         
         return StatusResponse(
             total_documents=total_count,
@@ -127,86 +345,190 @@ async def get_status():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/report", response_model=ReportResponse)
+@app.get(
+    "/report",
+    response_model=ReportResponse,
+    responses={
+        200: {
+            "description": (
+                "ReportResponse envelope for format=json; "
+                "streamed markdown for format=markdown"
+            ),
+            "content": {"text/markdown": {"schema": {"type": "string"}}}
+        }
+    }
+)
 async def get_report(
+    request: Request,
+    http_response: Response,
     format: str = Query(default="markdown", enum=["markdown", "json"]),
     start_date: Optional[str] = None,
     end_date: Optional[str] = None
 ):
     """Get a classification report."""
-    service = get_drive_service()
-    
-    try:
-        # Build query for classified documents
-        query_parts = ["properties has { key='classified' and value='true' }"]
-        
-        if start_date:
-            query_parts.append(f"modifiedTime >= '{start_date}'")
-        if end_date:
-            query_parts.append(f"modifiedTime <= '{end_date}'")
-            
-        query = " and ".join(query_parts)
-        
-        # Get classified documents
-        response = service.files().list(
-            q=query,
-            fields="files(id, name, properties)",
-            pageSize=1000
-        ).execute()
-        
-        files = response.get('files', [])
-        
-        # Generate report
-        if format == "markdown":
-            report_content = _generate_markdown_report(files)
-        else:
-            report_content = json.dumps(files, indent=2)
-            
-        return ReportResponse(
-            report_content=report_content,
+    files = await _get_classified_files(start_date, end_date)
+
+    if format == "markdown":
+        # Aggregate before streaming starts: a failure here must surface as
+        # a clean 500, not abort the stream after the 200 has gone out
+        try:
+            categories, confidence_levels = _aggregate_report_stats(files)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        # Stream the report as it is generated instead of materializing the
+        # full string and its JSON wrapper in memory
+        return StreamingResponse(
+            _iter_markdown_report(files, categories, confidence_levels),
+            media_type="text/markdown"
+        )
+
+    cache_key = (format, start_date, end_date)
+    report = report_cache.get(cache_key)
+    if report is None:
+        report = ReportResponse(
+            report_content=files,
             generated_at=datetime.now().isoformat(),
             format=format
         )
-        
+        report_cache[cache_key] = report
+
+    etag = response_etag(report)
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304)
+    http_response.headers['ETag'] = etag
+    return report
+
+async def _get_classified_files(
+    start_date: Optional[str],
+    end_date: Optional[str]
+) -> List[dict]:
+    """Fetch classified files from Drive, cached for the configured TTL."""
+    cache_key = ('files', start_date, end_date)
+    files = report_cache.get(cache_key)
+    if files is not None:
+        return files
+
+    service = get_drive_service()
+
+    query = build_report_query(start_date, end_date)
+
+    try:
+        # Get all classified documents, paging at Drive's maximum page size
+        # so a full enumeration costs the fewest round trips
+        files = []
+        page_token = None
+        while True:
+            response = await execute_drive_request(service.files().list(
+                q=query,
+                fields="nextPageToken, files(id, name, properties)",
+                pageSize=1000,
+                pageToken=page_token
+            ))
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        report_cache[cache_key] = files
+        return files
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def _generate_markdown_report(files: List[dict]) -> str:
-    """Generate a markdown format report."""
-    report_parts = [
-        "# Document Classification Report",
-        f"\nGenerated: {datetime.now().isoformat()}",
-        f"\nTotal Documents: {len(files)}",
-        "\n## Summary"
-    ]
-    
-    # Aggregate statistics
-    categories = {}
-    confidence_levels = {'HIGH': 0, 'MEDIUM': 0, 'LOW': 0}
-    
-    for file in files:
-        props = file.get('properties', {})
-        for cat in props.get('categories', '').split(','):
-            if cat:
-                categories[cat] = categories.get(cat, 0) + 1
-        
-        confidence = int(props.get('overall_confidence', 0))
-        if confidence >= 90:
-            confidence_levels['HIGH'] += 1
-        elif confidence >= 70:
-            confidence_levels['MEDIUM'] += 1
-        else:
-            confidence_levels['LOW'] += 1
-    
-    # Add statistics to report
-    report_parts.extend([
-        "\n### Categories",
-        *[f"- {cat}: {count}" for cat, count in categories.items()],
-        "\n### Confidence Levels",
-        *[f"- {level}: {count}" for level, count in confidence_levels.items()]
-    ])
-    
-    return "\n".join(report_parts)
+def _parse_confidence(value) -> float:
+    """Parse an overall_confidence property, coercing malformed values to 0."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _aggregate_report_stats(files: List[dict]):
+    """Tally category and confidence-level counts for a report."""
+    if pd is not None and files:
+        return _aggregate_report_stats_vectorized(files)
+    return _aggregate_report_stats_python(files)
+
+def _aggregate_report_stats_python(files: List[dict]):
+    """Pure-Python fallback for _aggregate_report_stats."""
+    # Counter does the tallying in C instead of a per-file Python dict
+    # update loop
+    categories = Counter(
+        cat
+        for file in files
+        for cat in file.get('properties', {}).get('categories', '').split(',')
+        if cat
+    )
+
+    confidence_labels = ('LOW', 'MEDIUM', 'HIGH')
+    confidence_levels = Counter({'HIGH': 0, 'MEDIUM': 0, 'LOW': 0})
+    confidence_levels.update(
+        confidence_labels[bisect.bisect_right(
+            (70, 90),
+            _parse_confidence(
+                file.get('properties', {}).get('overall_confidence', 0)
+            )
+        )]
+        for file in files
+    )
+
+    return categories, confidence_levels
+
+def _aggregate_report_stats_vectorized(files: List[dict]):
+    """Pandas fast path for _aggregate_report_stats on large reports."""
+    df = pd.json_normalize(files)
+
+    if 'properties.categories' in df.columns:
+        cats = df['properties.categories'].fillna('').str.split(',').explode()
+        categories = Counter(cats[cats != ''].value_counts().to_dict())
+    else:
+        categories = Counter()
+
+    if 'properties.overall_confidence' in df.columns:
+        # Malformed values coerce to 0, matching _parse_confidence
+        confidences = pd.to_numeric(
+            df['properties.overall_confidence'], errors='coerce'
+        ).fillna(0)
+    else:
+        confidences = pd.Series(0, index=df.index)
+
+    # Left-closed bins reproduce the fallback's >=70 / >=90 thresholds
+    # exactly, including for non-integer confidences
+    buckets = pd.cut(
+        confidences,
+        bins=[-float('inf'), 70, 90, float('inf')],
+        right=False,
+        labels=['LOW', 'MEDIUM', 'HIGH']
+    )
+    confidence_levels = Counter({'HIGH': 0, 'MEDIUM': 0, 'LOW': 0})
+    confidence_levels.update(
+        {str(label): count for label, count in buckets.value_counts().items()}
+    )
+
+    return categories, confidence_levels
+
+def _iter_markdown_report(
+    files: List[dict],
+    categories: Counter,
+    confidence_levels: Counter
+):
+    """Yield the markdown report line by line, with no intermediate lists."""
+    yield (
+        "# Document Classification Report\n"
+        f"\nGenerated: {datetime.now().isoformat()}\n"
+        f"\nTotal Documents: {len(files)}\n"
+        "\n## Summary\n"
+    )
+
+    yield "\n### Categories\n"
+    for cat, count in categories.items():
+        yield f"- {cat}: {count}\n"
+
+    yield "\n### Confidence Levels\n"
+    for level, count in confidence_levels.items():
+        yield f"- {level}: {count}\n"
 
 if __name__ == "__main__":
     import uvicorn
@@ -6,8 +6,32 @@ from fastapi.testclient import TestClient
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import api_server
 from api_server import app
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Reset module-level caches so no test sees another test's state."""
+    api_server.status_cache.clear()
+    api_server.report_cache.clear()
+    api_server._service_cache.clear()
+    api_server.build_documents_query.cache_clear()
+    api_server.build_report_query.cache_clear()
+    yield
+
+class FakeBatchRequest:
+    """Minimal stand-in for googleapiclient's BatchHttpRequest."""
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        for request_id, request, callback in self._requests:
+            callback(request_id, request.execute(), None)
+
 @pytest.fixture
 def test_config():
     return {
@@ -93,13 +117,21 @@ async def test_get_status(test_client, mocker):
     mock_total_files = {"files": [{"id": "doc1"}, {"id": "doc2"}, {"id": "doc3"}]}
     mock_classified_files = {"files": [{"id": "doc1"}, {"id": "doc2"}]}
     
-    # Set up mock responses
-    drive_mock = mocker.patch("api_server.build").return_value.files()
-    drive_mock.list().execute.side_effect = [
-        mock_total_files,
-        mock_classified_files
-    ]
-    
+    # Set up mock responses keyed on the query: the two list calls ship in
+    # one batch, so the mock shouldn't depend on call order
+    def mock_list(**kwargs):
+        request = mocker.MagicMock()
+        if "classified" in (kwargs.get("q") or ""):
+            request.execute.return_value = mock_classified_files
+        else:
+            request.execute.return_value = mock_total_files
+        return request
+
+    service_mock = mocker.patch("api_server.build").return_value
+    service_mock.new_batch_http_request.side_effect = FakeBatchRequest
+    drive_mock = service_mock.files()
+    drive_mock.list.side_effect = mock_list
+
     # Test status endpoint
     response = await test_client.get("/status")
     assert response.status_code == 200
@@ -148,12 +180,77 @@ async def test_get_report(test_client, mocker):
     assert data["format"] == "json"
     assert "report_content" in data
     
-    # Parse report content
-    report = json.loads(data["report_content"])
+    # Report content is the file list itself, not an embedded JSON string
+    report = data["report_content"]
     assert len(report) == 2
     assert report[0]["id"] == "doc1"
     assert report[1]["id"] == "doc2"
 
+@pytest.mark.asyncio
+async def test_get_report_markdown(test_client, mocker):
+    # Mock classified documents
+    mock_files = {
+        "files": [
+            {
+                "id": "doc1",
+                "name": "Document 1",
+                "properties": {
+                    "classified": "true",
+                    "overall_confidence": "90",
+                    "categories": "confidential,sensitive"
+                }
+            },
+            {
+                "id": "doc2",
+                "name": "Document 2",
+                "properties": {
+                    "classified": "true",
+                    "overall_confidence": "75",
+                    "categories": "internal"
+                }
+            }
+        ]
+    }
+
+    # Mock the drive service
+    mocker.patch("api_server.build").return_value.files().list().execute.return_value = mock_files
+
+    # Markdown reports stream as plain markdown, not a JSON envelope
+    response = await test_client.get("/report?format=markdown")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/markdown")
+
+    report = response.text
+    assert "# Document Classification Report" in report
+    assert "Total Documents: 2" in report
+    assert "### Categories" in report
+    assert "- confidential: 1" in report
+    assert "- internal: 1" in report
+    assert "### Confidence Levels" in report
+    assert "- HIGH: 1" in report
+    assert "- MEDIUM: 1" in report
+    assert "- LOW: 0" in report
+
+def test_report_stats_paths_agree():
+    # The pandas path is an optional accelerator; it must bucket boundary
+    # and malformed confidences exactly like the pure-Python fallback
+    files = [
+        {"id": "f1", "properties": {"overall_confidence": "70", "categories": "a,b"}},
+        {"id": "f2", "properties": {"overall_confidence": "90", "categories": "b"}},
+        {"id": "f3", "properties": {"overall_confidence": "89.5", "categories": ""}},
+        {"id": "f4", "properties": {"overall_confidence": "not-a-number"}},
+        {"id": "f5"}
+    ]
+
+    categories, confidence_levels = api_server._aggregate_report_stats_python(files)
+    assert categories == {"a": 1, "b": 2}
+    assert confidence_levels == {"HIGH": 1, "MEDIUM": 2, "LOW": 2}
+
+    vec_categories, vec_confidence_levels = \
+        api_server._aggregate_report_stats_vectorized(files)
+    assert vec_categories == categories
+    assert vec_confidence_levels == confidence_levels
+
 @pytest.mark.asyncio
 async def test_pagination(test_client, mocker):
     # Mock paginated responses
@@ -186,6 +283,44 @@ async def test_pagination(test_client, mocker):
     assert len(data["documents"]) == 1
     assert data["next_page_token"] is None
 
+@pytest.mark.asyncio
+async def test_multi_page_fetch(test_client, mocker):
+    # Mock paginated responses; two per request since the ETag re-fetch
+    # below walks the same two pages again
+    mock_page1 = {
+        "files": [{"id": "doc1", "name": "Document 1"}],
+        "nextPageToken": "page2_token"
+    }
+    mock_page2 = {
+        "files": [{"id": "doc2", "name": "Document 2"}],
+        "nextPageToken": "page3_token"
+    }
+
+    # Set up mock responses
+    drive_mock = mocker.patch("api_server.build").return_value.files()
+    drive_mock.list().execute.side_effect = [
+        mock_page1, mock_page2,
+        mock_page1, mock_page2
+    ]
+
+    # max_pages=2 walks both pages server-side and returns the combined
+    # list plus the token for the page after the last one fetched
+    response = await test_client.get("/documents?page_size=1&max_pages=2")
+    assert response.status_code == 200
+
+    data = response.json()
+    assert [doc["id"] for doc in data["documents"]] == ["doc1", "doc2"]
+    assert data["next_page_token"] == "page3_token"
+    assert data["total_count"] == 2
+
+    # An unchanged listing re-requested with the returned ETag gets a 304
+    etag = response.headers["etag"]
+    response = await test_client.get(
+        "/documents?page_size=1&max_pages=2",
+        headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
 @pytest.mark.asyncio
 async def test_error_handling(test_client, mocker):
     # Mock API error